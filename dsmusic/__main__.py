@@ -3,9 +3,11 @@ import os
 import logging
 import sys
 
-import discord
+from .profiling import profiler
 
-from .client import Client
+profiler.install()
+
+import discord  # noqa: E402
 
 try:
     import uvloop
@@ -63,14 +65,17 @@ def main():
 
     intents, permissions = setup_discord_auxiliary_objects()
 
-    client = Client(
-        intents=intents,
-        command_prefix="!",
-        activity=discord.CustomActivity(name="Gressinbon"),
-        status=discord.Status.online,
-        mentions=discord.AllowedMentions.none(),
-        help_command=None
-    )
+    with profiler.measure("client init"):
+        from .client import Client
+
+        client = Client(
+            intents=intents,
+            command_prefix="!",
+            activity=discord.CustomActivity(name="Gressinbon"),
+            status=discord.Status.online,
+            mentions=discord.AllowedMentions.none(),
+            help_command=None
+        )
 
     oauth_url = discord.utils.oauth_url(
         client_id=839827510761488404,
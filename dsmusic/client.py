@@ -3,12 +3,16 @@ import json
 import logging
 import os
 from os import getenv
+from typing import TYPE_CHECKING
 
 import discord
-import mafic
 from discord import app_commands
 from discord.ext import commands
-from mafic import NodeAlreadyConnected
+
+from .profiling import profiler
+
+if TYPE_CHECKING:
+    import mafic
 
 __all__ = [
     "Client"
@@ -28,9 +32,6 @@ class Client(commands.Bot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        # Add nodes
-        self.pool = mafic.NodePool(self)
-
         # App commands
         self.guild_id = discord.Object(id=getenv("DS_GUILD_ID", 0))
         self.tree.on_error = self.on_tree_error
@@ -39,14 +40,31 @@ class Client(commands.Bot):
         self.tracker_enabled = int(getenv("ENABLE_TRACKER", "1")) == 1
         self.music_enabled = int(getenv("ENABLE_MUSIC", "1")) == 1
 
-    async def setup_hook(self):
-        logger.info("Loading extensions")
+        # Add nodes, mafic is only imported when the music cog is enabled
+        self.pool: mafic.NodePool | None = None
+        if self.music_enabled:
+            import mafic
 
-        if self.tracker_enabled:
-            await self.load_extension("dsmusic.tracker.cog")
+            self.pool = mafic.NodePool(self)
 
+    @property
+    def extensions_enabled(self) -> list[str]:
+        extensions = []
+        if self.tracker_enabled:
+            extensions.append("dsmusic.tracker.cog")
         if self.music_enabled:
-            await self.load_extension("dsmusic.music.cog")
+            extensions.append("dsmusic.music.cog")
+        return extensions
+
+    async def _load_extension(self, name: str):
+        with profiler.measure(f"extension {name}"):
+            await self.load_extension(name)
+
+    async def setup_hook(self):
+        logger.info("Loading extensions")
+
+        for name in self.extensions_enabled:
+            await self._load_extension(name)
 
         logger.info("Extensions loaded")
 
@@ -55,7 +73,8 @@ class Client(commands.Bot):
 
         # Add lavalink nodes
         if self.music_enabled:
-            await self.add_nodes()
+            with profiler.measure("lavalink nodes"):
+                await self.add_nodes()
 
             if len(self.pool.nodes) == 0:
                 logger.warning("Disabling music cog")
@@ -63,8 +82,11 @@ class Client(commands.Bot):
 
         # This copies the global commands over to your guild.
         logger.info("Syncing command tree")
-        self.tree.copy_global_to(guild=self.guild_id)
-        await self.tree.sync(guild=self.guild_id)
+        with profiler.measure("command tree sync"):
+            self.tree.copy_global_to(guild=self.guild_id)
+            await self.tree.sync(guild=self.guild_id)
+
+        profiler.report()
 
     async def add_nodes(self):
         """Add and connect to lavalink nodes"""
@@ -84,32 +106,40 @@ class Client(commands.Bot):
             logger.error("Lavalink config not available")
             return
 
-        for node_info in data:
-            try:
-                async with asyncio.timeout(10):
-                    await self.pool.create_node(
-                        host=node_info["uri"],
-                        port=node_info["port"],
-                        label=f"CONFIG-{data.index(node_info)}",
-                        password=node_info["password"],
-                        secure=False,
-                        timeout=5,
-                    )
-                    logger.info(f"Node {node_info['uri']} added")
-            except NodeAlreadyConnected:
-                pass
-            except (TimeoutError, asyncio.TimeoutError) as e:
-                logger.error(f"Node {node_info['uri']}:{node_info['port']} timed out. {e}")
-            except RuntimeError as e:
-                logger.error(f"Node {node_info['uri']}:{node_info['port']} failed. {e}")
-            except Exception as e:
-                logger.error(e)
+        # Connect the nodes concurrently, so a slow node doesn't delay the others
+        await asyncio.gather(*(self._add_node(index, node_info) for index, node_info in enumerate(data)))
 
         if len(self.pool.nodes) == 0:
             logger.error("No nodes connected")
         else:
             logger.info(f"{len(self.pool.nodes)} nodes connected")
 
+    async def _add_node(self, index: int, node_info: dict):
+        from mafic import NodeAlreadyConnected
+
+        # noinspection PyShadowingNames
+        logger = logging.getLogger('dsbot.lavalink')
+
+        try:
+            async with asyncio.timeout(10):
+                await self.pool.create_node(
+                    host=node_info["uri"],
+                    port=node_info["port"],
+                    label=f"CONFIG-{index}",
+                    password=node_info["password"],
+                    secure=False,
+                    timeout=5,
+                )
+                logger.info(f"Node {node_info['uri']} added")
+        except NodeAlreadyConnected:
+            pass
+        except (TimeoutError, asyncio.TimeoutError) as e:
+            logger.error(f"Node {node_info['uri']}:{node_info['port']} timed out. {e}")
+        except RuntimeError as e:
+            logger.error(f"Node {node_info['uri']}:{node_info['port']} failed. {e}")
+        except Exception as e:
+            logger.error(e)
+
     # noinspection PyUnresolvedReferences
     @staticmethod
     async def on_tree_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
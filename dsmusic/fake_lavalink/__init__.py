@@ -0,0 +1,6 @@
+from .node import FakeNode, FakeNodeConfig
+
+__all__ = [
+    "FakeNode",
+    "FakeNodeConfig",
+]
@@ -0,0 +1,53 @@
+import argparse
+import asyncio
+import logging
+
+from .node import FakeNode, FakeNodeConfig
+
+
+async def serve(args: argparse.Namespace):
+    node = FakeNode(FakeNodeConfig(
+        password=args.password,
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        stuck_rate=args.stuck_rate,
+        track_length=args.track_length,
+        track_end_delay=args.track_end,
+    ))
+    await node.start(args.host, args.port)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await node.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake lavalink v4 node")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2333)
+    parser.add_argument("--password", default="youshallnotpass")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every REST response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability of a REST request failing")
+    parser.add_argument("--stuck-rate", type=float, default=0.0, help="probability of a track getting stuck")
+    parser.add_argument("--track-length", type=int, default=180_000, help="length of the tracks in milliseconds")
+    parser.add_argument("--track-end", type=float, default=None, help="seconds before a track ends")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] [%(levelname)s] %(name)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+    logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import discord
+import mafic
+
+from ..client import Client
+from .node import FakeNode, FakeNodeConfig
+
+__all__ = [
+    "LoadStats",
+    "run",
+]
+
+
+logger = logging.getLogger('dsbot.fake_lavalink.load')
+
+BOT_ID = 839827510761488404
+DJ_ROLE_ID = 1 << 40
+
+# Replies of the music cog that mean the command failed, the other ones are normal outcomes
+FAILURES = ("⚠️ An error occurred", "⚠️ Timed out")
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+        self.replies: Counter[str] = Counter()
+        self.tracks_started: Counter[int] = Counter()
+        self.tracks_ended: int = 0
+        self.nodes_lost: int = 0
+        self.races: int = 0
+        self.race_failures: int = 0
+
+    def record(self, op: str, elapsed: float):
+        self.latencies[op].append(elapsed)
+
+    def report(self, duration: float) -> str:
+        lines = []
+        if self.races:
+            lines.append(f"/skip racing a track end: {self.races} guilds, {self.race_failures} failed a check")
+
+        total = sum(len(values) for values in self.latencies.values())
+        lines.append(f"{total} commands in {duration:.1f}s ({total / duration:.1f}/s)")
+
+        for op, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            p95 = values[int(len(values) * 0.95)]
+            p99 = values[int(len(values) * 0.99)]
+            lines.append(
+                f"  /{op}: {len(values)} ok, p50 {statistics.median(values) * 1000:.1f}ms, "
+                f"p95 {p95 * 1000:.1f}ms, p99 {p99 * 1000:.1f}ms"
+            )
+
+        for op, count in sorted(self.errors.items()):
+            lines.append(f"  {op}: {count} failed")
+
+        for reply, count in self.replies.most_common():
+            lines.append(f"  {count:6d} x {reply}")
+
+        started = sum(self.tracks_started.values())
+        lines.append(f"{started} tracks started, {self.tracks_ended} ended, {self.nodes_lost} nodes lost")
+        return "\n".join(lines)
+
+
+class _FakeGateway:
+    """Answers the voice state updates of the bot like the discord gateway"""
+
+    def __init__(self, state):
+        self._state = state
+
+    async def voice_state(
+            self, guild_id: int, channel_id: int | None, self_mute: bool = False, self_deaf: bool = False
+    ):
+        guild = self._state._get_guild(guild_id)
+        if guild is None or (channel_id is None and guild.me.voice is None):
+            return
+
+        self._state.parse_voice_state_update({
+            "guild_id": str(guild_id),
+            "channel_id": None if channel_id is None else str(channel_id),
+            "user_id": str(BOT_ID),
+            "session_id": uuid.uuid4().hex,
+            "deaf": False,
+            "mute": False,
+            "self_deaf": self_deaf,
+            "self_mute": self_mute,
+            "self_video": False,
+            "suppress": False,
+            "request_to_speak_timestamp": None,
+        })
+        if channel_id is not None:
+            self._state.parse_voice_server_update({
+                "guild_id": str(guild_id), "token": uuid.uuid4().hex, "endpoint": "fake.discord.media:443"
+            })
+
+
+class _Response:
+    """The parts of discord.InteractionResponse used by the music cog"""
+
+    def __init__(self, interaction: "_Interaction"):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, **kwargs):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        self._done = True
+
+    async def send_message(self, content: str | None = None, **kwargs):
+        await self.defer()
+        self._interaction.replies.append(content)
+
+
+class _Followup:
+    def __init__(self, interaction: "_Interaction"):
+        self._interaction = interaction
+
+    async def send(self, content: str | None = None, **kwargs):
+        self._interaction.replies.append(content)
+
+
+class _Interaction:
+    """An interaction of a member, keeping the replies instead of sending them"""
+
+    def __init__(self, member: discord.Member):
+        self.user = member
+        self.guild = member.guild
+        self.guild_id = member.guild.id
+        self.replies: list[str | None] = []
+        self.response = _Response(self)
+        self.followup = _Followup(self)
+
+    @property
+    def failed(self) -> bool:
+        return any(reply is not None and reply.startswith(FAILURES) for reply in self.replies)
+
+
+def _user(user_id: int, bot: bool = False) -> dict:
+    return {"id": str(user_id), "username": f"user{user_id}", "discriminator": "0", "avatar": None, "bot": bot}
+
+
+def _member(user_id: int, roles: list[int], bot: bool = False) -> dict:
+    return {
+        "user": _user(user_id, bot=bot), "roles": [str(role) for role in roles], "joined_at": None,
+        "deaf": False, "mute": False, "flags": 0,
+    }
+
+
+def _guild_payload(guild_id: int, users: int) -> dict:
+    """A GUILD_CREATE payload with a voice channel, the bot and some users listening in it"""
+    channel_id = guild_id + 1
+    members = [_member(BOT_ID, [], bot=True)]
+    voice_states = []
+    for i in range(users):
+        user_id = guild_id + 2 + i
+        # The first user is a DJ, the other ones have to vote
+        members.append(_member(user_id, [DJ_ROLE_ID] if i == 0 else []))
+        voice_states.append({
+            "user_id": str(user_id), "channel_id": str(channel_id), "session_id": uuid.uuid4().hex,
+            "deaf": False, "mute": False, "self_deaf": False, "self_mute": False, "self_video": False,
+            "suppress": False, "request_to_speak_timestamp": None,
+        })
+
+    return {
+        "id": str(guild_id),
+        "name": f"Load {guild_id}",
+        "owner_id": str(guild_id + 1_000),
+        "member_count": len(members),
+        "roles": [
+            {"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0},
+            {"id": str(DJ_ROLE_ID), "name": "DJ", "permissions": "0", "position": 1},
+        ],
+        "channels": [{
+            "id": str(channel_id), "type": 2, "name": "music", "position": 0, "bitrate": 64000, "user_limit": 0,
+        }],
+        "members": members,
+        "voice_states": voice_states,
+    }
+
+
+class _LoadClient(Client):
+    """The bot, with the discord gateway replaced by _FakeGateway and the events counted in the stats"""
+
+    def __init__(self, stats: LoadStats, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+
+    async def start_offline(self, guilds: list[dict]):
+        """
+        Do what login and the READY event would do, then start like the real bot
+        The extensions are loaded and the nodes are added from the config in the working directory
+        :param guilds: the GUILD_CREATE payloads of the guilds of the bot
+        :return: None
+        """
+        await self._async_setup_hook()
+        state = self._connection
+        state.user = discord.ClientUser(state=state, data=_user(BOT_ID, bot=True))
+        self.ws = _FakeGateway(state)
+        for data in guilds:
+            state._add_guild_from_data(data)
+
+        await self.setup_hook()
+        self._ready.set()
+        await self.add_nodes()
+
+    async def on_error(self, event_method: str, /, *args, **kwargs):
+        self.stats.errors[event_method] += 1
+        logger.debug(f"Error in {event_method}", exc_info=True)
+
+    async def on_track_start(self, event: mafic.TrackStartEvent):
+        self.stats.tracks_started[event.player.guild.id] += 1
+
+    async def on_track_end(self, event: mafic.TrackEndEvent):
+        self.stats.tracks_ended += 1
+
+    async def on_node_unavailable(self, node: mafic.Node):
+        self.stats.nodes_lost += 1
+
+
+async def _command(cog, stats: LoadStats, op: str, member: discord.Member, *args) -> _Interaction:
+    """
+    Run the callback of an app command of the music cog, like discord does after the checks
+    :return: the interaction, with the replies of the command
+    """
+    interaction = _Interaction(member)
+    command: discord.app_commands.Command = getattr(cog, op)
+    start = time.perf_counter()
+    try:
+        await command.callback(cog, interaction, *args)
+    except Exception as e:
+        stats.errors[f"/{op}"] += 1
+        logger.debug(f"/{op} failed in guild {member.guild.id}: {e!r}")
+        return interaction
+
+    if interaction.failed:
+        stats.errors[f"/{op}"] += 1
+    else:
+        stats.record(op, time.perf_counter() - start)
+    for reply in interaction.replies:
+        if reply is not None:
+            stats.replies[reply.split(":")[0].split("(")[0].strip()] += 1
+    return interaction
+
+
+async def _settle(cog, guild: discord.Guild):
+    # Let the end events reach the cog and the jobs they submit run
+    await asyncio.sleep(0.5)
+    await cog.executor.run(guild.id, lambda: asyncio.sleep(0))
+
+
+def _playing(nodes: list[FakeNode], guild: discord.Guild) -> str | None:
+    """The title of the track a node is playing for the guild"""
+    for node in nodes:
+        for session in node.sessions.values():
+            player = session.players.get(str(guild.id))
+            if player is not None and player.track is not None:
+                return player.track["info"]["title"]
+    return None
+
+
+async def _race_skip(cog, nodes: list[FakeNode], stats: LoadStats, dj: discord.Member, queries: list[str]) -> int:
+    """
+    Queue some tracks, then skip the current one while it ends
+    :return: the number of times the queue advanced
+    """
+    guild = dj.guild
+    started = stats.tracks_started[guild.id]
+    for query in queries:
+        await _command(cog, stats, "play", dj, query)
+
+    await asyncio.gather(
+        _command(cog, stats, "skip", dj),
+        *(node.end_track(guild.id) for node in nodes),
+    )
+    await _settle(cog, guild)
+
+    # The queue was empty, the first track was started by /play
+    return stats.tracks_started[guild.id] - started - 1
+
+
+async def _check_skip_race(cog, nodes: list[FakeNode], stats: LoadStats, guild: discord.Guild) -> bool:
+    """
+    Skip the current track while it ends, the queue must move forward by exactly one track. The same is checked with
+    copies of the same track, and the tracks added after /reset must be played when the current one ends
+    :return: True if every check passed
+    """
+    dj = next(member for member in guild.members if guild.get_role(DJ_ROLE_ID) in member.roles)
+    ok = True
+
+    races = {
+        "distinct tracks": [f"race {guild.id} {i}" for i in range(3)],
+        "copies of a track": [f"https://race/{guild.id}/same", f"https://race/{guild.id}/same",
+                              f"https://race/{guild.id}/other"],
+    }
+    for name, queries in races.items():
+        advances = await _race_skip(cog, nodes, stats, dj, queries)
+        if advances != 1:
+            logger.error(f"The queue of guild {guild.id} advanced {advances} times instead of once with {name}")
+            ok = False
+
+        await _command(cog, stats, "reset", dj)
+        await _settle(cog, guild)
+
+    for query in ("a", "b"):
+        await _command(cog, stats, "play", dj, f"https://race/{guild.id}/{query}")
+    await _command(cog, stats, "reset", dj)
+    after_reset = [f"https://race/{guild.id}/{query}" for query in ("c", "d")]
+    for query in after_reset:
+        await _command(cog, stats, "play", dj, query)
+    await asyncio.gather(*(node.end_track(guild.id) for node in nodes))
+    await _settle(cog, guild)
+
+    playing = _playing(nodes, guild)
+    if playing not in after_reset:
+        logger.error(f"Guild {guild.id} is playing {playing} instead of a track added after /reset")
+        ok = False
+
+    return ok
+
+
+async def _drive(cog, guild: discord.Guild, stats: LoadStats, deadline: float, think_time: float, play_ratio: float):
+    listeners = [member for member in guild.members if not member.bot]
+    while True:
+        # The next command would come after the end of the run
+        delay = random.expovariate(1 / think_time)
+        if time.monotonic() + delay >= deadline:
+            break
+        await asyncio.sleep(delay)
+
+        member = random.choice(listeners)
+        if random.random() < play_ratio:
+            await _command(cog, stats, "play", member, f"song {random.randint(0, 10_000)}")
+        else:
+            await _command(cog, stats, "skip", member)
+
+
+async def run(args: argparse.Namespace) -> LoadStats:
+    """
+    Start the fake nodes and the bot without discord, then drive the music commands of the guilds
+    :param args: the parsed command line arguments
+    :return: the collected statistics
+    """
+    config = FakeNodeConfig(
+        password=args.password,
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        stuck_rate=args.stuck_rate,
+        track_end_delay=args.track_end,
+        stats_interval=args.stats_interval,
+    )
+
+    nodes = [FakeNode(config) for _ in range(args.nodes)]
+    for i, node in enumerate(nodes):
+        await node.start(args.host, args.port + i)
+
+    stats = LoadStats()
+    guilds = [_guild_payload((i + 1) << 22, args.users) for i in range(args.guilds)]
+
+    # The bot reads its config and writes its data in the working directory
+    os.environ["ENABLE_TRACKER"] = "0"
+    os.environ["ENABLE_MUSIC"] = "1"
+    with tempfile.TemporaryDirectory() as directory, contextlib.chdir(directory):
+        os.makedirs("config")
+        with open("config/lavalink.json", "w") as f:
+            json.dump([
+                {"uri": args.host, "port": args.port + i, "password": args.password} for i in range(args.nodes)
+            ], f)
+        with open("config/queue.json", "w") as f:
+            json.dump({"default": {"dj_role": DJ_ROLE_ID}}, f)
+
+        intents = discord.Intents.none()
+        intents.guilds = intents.members = intents.voice_states = True
+        client = _LoadClient(stats, intents=intents, command_prefix="!", help_command=None)
+        await client.start_offline(guilds)
+        cog = client.get_cog("Music")
+
+        if args.kill_after is not None:
+            async def kill():
+                await asyncio.sleep(args.kill_after)
+                logger.warning("Stopping node CONFIG-0")
+                await nodes[0].stop()
+
+            asyncio.get_running_loop().create_task(kill())
+
+        start = time.monotonic()
+        if args.check_skip_race:
+            results = await asyncio.gather(*(_check_skip_race(cog, nodes, stats, guild) for guild in client.guilds))
+            stats.races = len(results)
+            stats.race_failures = results.count(False)
+        else:
+            deadline = start + args.duration
+            await asyncio.gather(*(
+                _drive(cog, guild, stats, deadline, args.think_time, args.play_ratio) for guild in client.guilds
+            ))
+        elapsed = time.monotonic() - start
+
+        print(stats.report(elapsed))
+        for i, node in enumerate(nodes):
+            print(f"CONFIG-{i}: {node.requests} requests, {node.failures} simulated failures")
+
+        await client.unload_extension("dsmusic.music.cog")
+        await client.pool.close()
+
+    for node in nodes:
+        await node.stop()
+
+    return stats
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the music cog against fake lavalink nodes, without discord")
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--users", type=int, default=5, help="listeners in the voice channel of each guild")
+    parser.add_argument("--nodes", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean seconds between commands of a guild")
+    parser.add_argument("--play-ratio", type=float, default=0.7, help="share of /play over /skip")
+    parser.add_argument("--kill-after", type=float, default=None, help="stop the first node after these seconds")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2333)
+    parser.add_argument("--password", default="youshallnotpass")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--stuck-rate", type=float, default=0.0)
+    parser.add_argument("--track-end", type=float, default=5.0, help="seconds before a track ends")
+    parser.add_argument("--stats-interval", type=float, default=5.0)
+    parser.add_argument(
+        "--check-skip-race", action="store_true",
+        help="instead of the load, skip a track of every guild while it ends and play tracks after /reset, exit "
+             "with 1 if a queue doesn't advance by exactly one track or the new tracks aren't played"
+    )
+    return parser.parse_args(argv)
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] [%(levelname)s] %(name)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+    logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
+    logging.getLogger('discord').setLevel(logging.WARNING)
+    logging.getLogger('mafic').setLevel(logging.CRITICAL)
+    # Failed commands are counted in the report
+    logging.getLogger('dsbot.music').setLevel(logging.CRITICAL)
+
+    stats = asyncio.run(run(parse_args()))
+    if stats.race_failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+import asyncio
+import base64
+import json
+import logging
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from http import HTTPStatus
+
+from aiohttp import web, WSMsgType
+
+__all__ = [
+    "FakeNodeConfig",
+    "FakeNode",
+]
+
+
+logger = logging.getLogger('dsbot.fake_lavalink.node')
+
+LAVALINK_VERSION = "4.0.0"
+
+
+@dataclass(slots=True)
+class FakeNodeConfig:
+    password: str = "youshallnotpass"
+    latency: float = 0.0  # seconds added to every REST response
+    jitter: float = 0.0  # random extra latency, up to this value
+    failure_rate: float = 0.0  # probability of a REST request failing with a 500
+    stuck_rate: float = 0.0  # probability of a track getting stuck instead of finishing
+    track_length: int = 180_000  # milliseconds, reported length of the tracks
+    track_end_delay: float | None = None  # seconds before a track ends, None uses track_length
+    search_results: int = 5
+    playlist_size: int = 20
+    stats_interval: float = 60.0
+    player_update_interval: float = 5.0
+
+
+def encode_track(info: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(info).encode()).decode()
+
+
+def decode_track(encoded: str) -> dict:
+    return json.loads(base64.urlsafe_b64decode(encoded.encode()))
+
+
+def make_track(identifier: str, title: str, length: int) -> dict:
+    info = {
+        "identifier": identifier,
+        "isSeekable": True,
+        "author": "Fake Lavalink",
+        "length": length,
+        "isStream": False,
+        "position": 0,
+        "title": title,
+        "uri": f"https://www.youtube.com/watch?v={identifier}",
+        "artworkUrl": None,
+        "isrc": None,
+        "sourceName": "youtube",
+    }
+    return {"encoded": encode_track(info), "info": info, "pluginInfo": {}, "userData": {}}
+
+
+def _now() -> int:
+    return int(time.time() * 1000)
+
+
+class _FakePlayer:
+    def __init__(self, guild_id: str):
+        self.guild_id = guild_id
+        self.track: dict | None = None
+        self.started_at: int = 0
+        self.paused: bool = False
+        self.volume: int = 100
+        self.voice: dict = {"token": "", "endpoint": "", "sessionId": ""}
+        self.filters: dict = {}
+        self.end_task: asyncio.Task | None = None
+
+    @property
+    def position(self) -> int:
+        if self.track is None:
+            return 0
+        return min(_now() - self.started_at, self.track["info"]["length"])
+
+    def state(self) -> dict:
+        return {"time": _now(), "position": self.position, "connected": True, "ping": 0}
+
+    def to_dict(self) -> dict:
+        return {
+            "guildId": self.guild_id,
+            "track": self.track,
+            "volume": self.volume,
+            "paused": self.paused,
+            "state": self.state(),
+            "voice": self.voice,
+            "filters": self.filters,
+        }
+
+
+class _FakeSession:
+    def __init__(self, ws: web.WebSocketResponse, transport: asyncio.Transport | None):
+        self.id = uuid.uuid4().hex[:16]
+        self.ws = ws
+        self.transport = transport
+        self.players: dict[str, _FakePlayer] = {}
+        self.resuming: bool = False
+        self.timeout: int = 60
+
+    async def send(self, payload: dict):
+        if self.ws.closed:
+            return
+        try:
+            await self.ws.send_str(json.dumps(payload))
+        except ConnectionError:
+            pass
+
+
+class FakeNode:
+    """
+    A Lavalink v4 node that only keeps players in memory
+
+    It answers to the REST routes and websocket messages used by mafic, tracks are made up from
+    the identifier and "play" for a configurable amount of time.
+    """
+
+    def __init__(self, config: FakeNodeConfig | None = None):
+        self.config = config or FakeNodeConfig()
+        self.sessions: dict[str, _FakeSession] = {}
+        self.started_at: int = _now()
+
+        # Counters, useful to check the load
+        self.requests: int = 0
+        self.failures: int = 0
+
+        self._runner: web.AppRunner | None = None
+        self._stats_task: asyncio.Task | None = None
+
+        self.app = web.Application(middlewares=[self._middleware])
+        self.app.add_routes([
+            web.get("/version", self.version),
+            web.get("/v4/websocket", self.websocket),
+            web.get("/v4/info", self.info),
+            web.get("/v4/stats", self.stats),
+            web.get("/v4/loadtracks", self.load_tracks),
+            web.get("/v4/decodetrack", self.decode_track),
+            web.post("/v4/decodetracks", self.decode_tracks),
+            web.patch("/v4/sessions/{session_id}", self.update_session),
+            web.get("/v4/sessions/{session_id}/players", self.get_players),
+            web.get("/v4/sessions/{session_id}/players/{guild_id}", self.get_player),
+            web.patch("/v4/sessions/{session_id}/players/{guild_id}", self.update_player),
+            web.delete("/v4/sessions/{session_id}/players/{guild_id}", self.destroy_player),
+        ])
+
+    async def start(self, host: str = "127.0.0.1", port: int = 2333):
+        """
+        Start listening for connections
+        :param host: the address to bind
+        :param port: the port to bind
+        :return: None
+        """
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._stats_task = asyncio.create_task(self._stats_loop())
+        logger.info(f"Fake lavalink node listening on {host}:{port}")
+
+    async def stop(self):
+        """
+        Drop every connection and stop the server, like a node crash
+        :return: None
+        """
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+            self._stats_task = None
+
+        for session in list(self.sessions.values()):
+            # Abort instead of sending a close frame, clients see the connection dropping
+            if session.transport is not None:
+                session.transport.abort()
+            await self._close_session(session)
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.requests += 1
+
+        if request.headers.get("Authorization") != self.config.password:
+            return self._error(request, 401, "Unauthorized")
+
+        if request.path != "/v4/websocket":
+            delay = self.config.latency + random.uniform(0, self.config.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if random.random() < self.config.failure_rate:
+                self.failures += 1
+                return self._error(request, 500, "Simulated failure")
+
+        return await handler(request)
+
+    @staticmethod
+    def _error(request: web.Request, status: int, message: str) -> web.Response:
+        return web.json_response({
+            "timestamp": _now(),
+            "status": status,
+            "error": HTTPStatus(status).phrase,
+            "message": message,
+            "path": request.path,
+        }, status=status)
+
+    def _get_session(self, request: web.Request) -> _FakeSession:
+        session = self.sessions.get(request.match_info["session_id"])
+        if session is None:
+            raise web.HTTPNotFound(
+                text=self._error(request, 404, "Session not found").text, content_type="application/json"
+            )
+        return session
+
+    # Websocket
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        resumed = False
+        session = self.sessions.get(request.headers.get("Session-Id", ""))
+        if session is not None and session.resuming and session.ws.closed:
+            session.ws = ws
+            session.transport = request.transport
+            resumed = True
+        else:
+            session = _FakeSession(ws, request.transport)
+            self.sessions[session.id] = session
+
+        logger.debug(f"Session {session.id} connected, resumed: {resumed}")
+        await session.send({"op": "ready", "resumed": resumed, "sessionId": session.id})
+        await session.send(self._stats_payload())
+
+        async for msg in ws:
+            if msg.type == WSMsgType.ERROR:
+                break
+
+        if self.sessions.get(session.id) is session:
+            if session.resuming:
+                asyncio.get_running_loop().call_later(session.timeout, self._expire_session, session)
+            else:
+                await self._close_session(session)
+
+        return ws
+
+    def _expire_session(self, session: _FakeSession):
+        if session.ws.closed and self.sessions.get(session.id) is session:
+            asyncio.create_task(self._close_session(session))
+
+    async def _close_session(self, session: _FakeSession):
+        self.sessions.pop(session.id, None)
+        for player in session.players.values():
+            if player.end_task is not None:
+                player.end_task.cancel()
+        session.players.clear()
+        await session.ws.close()
+
+    async def _stats_loop(self):
+        elapsed = 0.0
+        step = min(self.config.stats_interval, self.config.player_update_interval)
+        while True:
+            await asyncio.sleep(step)
+            elapsed += step
+
+            for session in list(self.sessions.values()):
+                for player in list(session.players.values()):
+                    await session.send({"op": "playerUpdate", "guildId": player.guild_id, "state": player.state()})
+                if elapsed >= self.config.stats_interval:
+                    await session.send(self._stats_payload())
+
+            if elapsed >= self.config.stats_interval:
+                elapsed = 0.0
+
+    def _stats_payload(self) -> dict:
+        players = [player for session in self.sessions.values() for player in session.players.values()]
+        return {
+            "op": "stats",
+            "players": len(players),
+            "playingPlayers": sum(1 for player in players if player.track is not None and not player.paused),
+            "uptime": _now() - self.started_at,
+            "memory": {"free": 384 << 20, "used": 128 << 20, "allocated": 512 << 20, "reservable": 1 << 30},
+            "cpu": {"cores": 1, "systemLoad": 0.0, "lavalinkLoad": 0.0},
+            "frameStats": None,
+        }
+
+    # Playback
+
+    async def end_track(self, guild_id: int, reason: str = "finished") -> bool:
+        """
+        End the track of a player now, as if it reached its end
+        :param guild_id: the id of the guild of the player
+        :param reason: the reason sent in the TrackEndEvent
+        :return: True if the player was playing a track
+        """
+        for session in self.sessions.values():
+            player = session.players.get(str(guild_id))
+            if player is not None and player.track is not None:
+                await self._end_track(session, player, reason)
+                return True
+        return False
+
+    async def _start_track(self, session: _FakeSession, player: _FakePlayer, track: dict):
+        if player.track is not None:
+            await self._end_track(session, player, "replaced")
+
+        player.track = track
+        player.started_at = _now()
+        await session.send({"op": "event", "type": "TrackStartEvent", "guildId": player.guild_id, "track": track})
+
+        delay = self.config.track_end_delay
+        if delay is None:
+            delay = track["info"]["length"] / 1000
+        player.end_task = asyncio.create_task(self._finish_track(session, player, track, delay))
+
+    async def _finish_track(self, session: _FakeSession, player: _FakePlayer, track: dict, delay: float):
+        await asyncio.sleep(delay)
+        if player.track is not track:
+            return
+
+        player.end_task = None
+        if random.random() < self.config.stuck_rate:
+            # Like lavalink, a stuck track keeps the player busy until the client replaces or stops it
+            await session.send({
+                "op": "event", "type": "TrackStuckEvent", "guildId": player.guild_id,
+                "track": track, "thresholdMs": 10000,
+            })
+        else:
+            await self._end_track(session, player, "finished")
+
+    async def _end_track(self, session: _FakeSession, player: _FakePlayer, reason: str):
+        track = player.track
+        player.track = None
+        if player.end_task is not None and player.end_task is not asyncio.current_task():
+            player.end_task.cancel()
+        player.end_task = None
+        await session.send({
+            "op": "event", "type": "TrackEndEvent", "guildId": player.guild_id, "track": track, "reason": reason,
+        })
+
+    # REST
+
+    async def version(self, request: web.Request) -> web.Response:
+        return web.Response(text=LAVALINK_VERSION)
+
+    async def info(self, request: web.Request) -> web.Response:
+        major, minor, patch = LAVALINK_VERSION.split(".")
+        return web.json_response({
+            "version": {
+                "semver": LAVALINK_VERSION, "major": int(major), "minor": int(minor), "patch": int(patch),
+                "preRelease": None, "build": None,
+            },
+            "buildTime": 0,
+            "git": {"branch": "fake", "commit": "0", "commitTime": 0},
+            "jvm": "none",
+            "lavaplayer": "none",
+            "sourceManagers": ["youtube"],
+            "filters": [],
+            "plugins": [],
+        })
+
+    async def stats(self, request: web.Request) -> web.Response:
+        payload = self._stats_payload()
+        del payload["op"]
+        return web.json_response(payload)
+
+    async def load_tracks(self, request: web.Request) -> web.Response:
+        identifier = request.query.get("identifier", "")
+        key = uuid.uuid5(uuid.NAMESPACE_URL, identifier).hex[:11]
+        length = self.config.track_length
+
+        if identifier == "" or "empty" in identifier:
+            return web.json_response({"loadType": "empty", "data": {}})
+        elif "error" in identifier:
+            return web.json_response({
+                "loadType": "error",
+                "data": {"message": "Simulated load error", "severity": "common", "cause": "fake"},
+            })
+        elif "list=" in identifier:
+            tracks = [make_track(f"{key}{i}", f"Track {i} of {identifier}", length)
+                      for i in range(self.config.playlist_size)]
+            return web.json_response({
+                "loadType": "playlist",
+                "data": {"info": {"name": identifier, "selectedTrack": -1}, "pluginInfo": {}, "tracks": tracks},
+            })
+        elif identifier.startswith(("http://", "https://")):
+            return web.json_response({"loadType": "track", "data": make_track(key, identifier, length)})
+        else:
+            query = identifier.split(":", 1)[-1]
+            tracks = [make_track(f"{key}{i}", f"{query} #{i}", length) for i in range(self.config.search_results)]
+            return web.json_response({"loadType": "search", "data": tracks})
+
+    async def decode_track(self, request: web.Request) -> web.Response:
+        encoded = request.query.get("encodedTrack", "")
+        try:
+            info = decode_track(encoded)
+        except ValueError:
+            return self._error(request, 400, "Invalid track")
+        return web.json_response({"encoded": encoded, "info": info, "pluginInfo": {}, "userData": {}})
+
+    async def decode_tracks(self, request: web.Request) -> web.Response:
+        try:
+            tracks = [{"encoded": encoded, "info": decode_track(encoded), "pluginInfo": {}, "userData": {}}
+                      for encoded in await request.json()]
+        except ValueError:
+            return self._error(request, 400, "Invalid track")
+        return web.json_response(tracks)
+
+    async def update_session(self, request: web.Request) -> web.Response:
+        session = self._get_session(request)
+        data = await request.json()
+        session.resuming = data.get("resuming", session.resuming)
+        session.timeout = data.get("timeout", session.timeout)
+        return web.json_response({"resuming": session.resuming, "timeout": session.timeout})
+
+    async def get_players(self, request: web.Request) -> web.Response:
+        session = self._get_session(request)
+        return web.json_response([player.to_dict() for player in session.players.values()])
+
+    async def get_player(self, request: web.Request) -> web.Response:
+        session = self._get_session(request)
+        player = session.players.get(request.match_info["guild_id"])
+        if player is None:
+            return self._error(request, 404, "Player not found")
+        return web.json_response(player.to_dict())
+
+    async def update_player(self, request: web.Request) -> web.Response:
+        session = self._get_session(request)
+        guild_id = request.match_info["guild_id"]
+        player = session.players.setdefault(guild_id, _FakePlayer(guild_id))
+        data = await request.json()
+        no_replace = request.query.get("noReplace", "false").lower() == "true"
+
+        if "voice" in data:
+            player.voice = data["voice"]
+            # Like lavalink once it joins the voice channel, mafic waits for it to consider the player connected
+            await session.send({"op": "playerUpdate", "guildId": guild_id, "state": player.state()})
+        if "volume" in data:
+            player.volume = data["volume"]
+        if "paused" in data:
+            player.paused = data["paused"]
+        if "filters" in data:
+            player.filters = data["filters"]
+
+        if "track" in data and isinstance(data["track"], dict):
+            encoded = data["track"].get("encoded", data["track"].get("identifier"))
+        else:
+            encoded = data.get("encodedTrack", data.get("identifier", ...))
+
+        if encoded is None:
+            if player.track is not None:
+                await self._end_track(session, player, "stopped")
+        elif encoded is not ...:
+            if not (no_replace and player.track is not None):
+                try:
+                    info = decode_track(encoded)
+                except ValueError:
+                    info = make_track(encoded, encoded, self.config.track_length)["info"]
+                    encoded = encode_track(info)
+                await self._start_track(session, player, {
+                    "encoded": encoded, "info": info, "pluginInfo": {}, "userData": {},
+                })
+
+        return web.json_response(player.to_dict())
+
+    async def destroy_player(self, request: web.Request) -> web.Response:
+        session = self._get_session(request)
+        player = session.players.pop(request.match_info["guild_id"], None)
+        if player is not None and player.end_task is not None:
+            player.end_task.cancel()
+        return web.Response(status=204)
@@ -7,25 +7,93 @@ from discord import app_commands
 from discord.channel import VocalGuildChannel
 from discord.ext import commands, tasks
 
+from .executor import GuildExecutor
+from .history import PlayHistory
 from .player import LavalinkPlayer
+from .policy import QueuePolicies, QueuePolicy
 
 logger = logging.getLogger('dsbot.music.cog')
 
 
+def is_dj(member: discord.Member, policy: QueuePolicy) -> bool:
+    """Check if a member can control the player without votes"""
+    if policy.dj_role is None or member.guild_permissions.manage_channels:
+        return True
+    return any(role.id == policy.dj_role for role in member.roles)
+
+
 @app_commands.guild_only()
 class Music(commands.Cog):
     def __init__(self, bot: discord.Client):
         self.bot = bot
+        self.policies = QueuePolicies.load()
+        self.history = PlayHistory()
+        # Commands changing the player of a guild run one at a time
+        self.executor = GuildExecutor()
+
+    async def cog_load(self):
+        self.flush_history.start()
+
+    async def cog_unload(self):
+        self.flush_history.cancel()
+        await self.history.close()
+
+    @tasks.loop(seconds=30)
+    async def flush_history(self):
+        await self.history.flush()
 
     @commands.Cog.listener(name="on_track_end")
     @commands.Cog.listener(name="on_track_stuck")
     async def on_track_end(self, event: mafic.TrackEndEvent | mafic.TrackStuckEvent):
         player: LavalinkPlayer = event.player
 
-        track = player.queue.next()
+        # The play keeps who added the track, even if a command already moved the queue
+        if isinstance(event, mafic.TrackEndEvent):
+            play = player.end_play(event.track)
+            reason = event.reason.value
+        else:
+            play = player.find_play(event.track)
+            reason = "stuck"
+        self.history.record(player.guild.id, None if play is None else play.requester, event.track, reason)
+
+        # A replaced or stopped track was already handled by the command that did it
+        if isinstance(event, mafic.TrackEndEvent) and event.reason not in (
+                mafic.EndReason.FINISHED, mafic.EndReason.LOAD_FAILED):
+            return
+
+        # A later play is outstanding, so /skip already moved to the next track and advancing again would skip it too
+        if player.plays and player.plays[-1] is not play:
+            return
+
+        # After /reset nothing is current, the next track added is played
+        expected = player.queue.current
+        await self.executor.run(
+            player.guild.id, lambda: self._advance(player, expected), key=("advance", id(expected))
+        )
+
+    @staticmethod
+    async def _advance(vc: LavalinkPlayer, expected: mafic.Track | None):
+        """
+        Play the next track of the queue
+        :param vc: the player
+        :param expected: the track that should be playing, if it already changed nothing is done
+        :return: None
+        """
+        if vc.queue.current is not expected:
+            return
+
+        vc.skip_votes.clear()
+        track = vc.queue.next()
 
         if track:
-            return await player.play(track, replace=True)
+            await vc.play_track(track, vc.queue.current_requester)
+        elif vc.current is not None:
+            await vc.stop()
+
+    async def _start(self, vc: LavalinkPlayer):
+        # The track left playing by /reset can still be ending
+        if vc.queue.current is None or vc.current is None or vc.paused is True:
+            await self._advance(vc, vc.queue.current)
 
     @commands.Cog.listener("on_voice_state_update")
     async def auto_disconnect(self, mb: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
@@ -59,13 +127,26 @@ class Music(commands.Cog):
         if vc is None:
             return await resp.send_message("❌ Not connected to a voice channel", ephemeral=True)
 
-        track = vc.queue.next()
-        await resp.send_message("✅ Skipping current track", ephemeral=True)
+        expected = vc.queue.current
+        member = interaction.user
 
-        if track:
-            return await vc.play(track, replace=True)
+        if is_dj(member, vc.queue.policy) or vc.queue.current_requester == member.id:
+            await resp.send_message("✅ Skipping current track", ephemeral=True)
         else:
-            return await vc.stop()
+            listeners = {m.id for m in vc.channel.members if not m.bot}
+            if member.id not in listeners:
+                return await resp.send_message("❌ You are not in the voice channel", ephemeral=True)
+
+            vc.skip_votes.add(member.id)
+            votes = len(vc.skip_votes & listeners)
+            needed = vc.queue.policy.skip_votes_needed(len(listeners))
+            if votes < needed:
+                return await resp.send_message(f"🗳️ Vote to skip registered ({votes}/{needed})")
+            await resp.send_message(f"✅ Vote passed ({votes}/{needed}), skipping current track")
+
+        await self.executor.run(
+            interaction.guild_id, lambda: self._advance(vc, expected), key=("advance", id(expected))
+        )
 
     @app_commands.command(name="play", description="Play a song from YouTube")
     @app_commands.checks.cooldown(3, 10, key=lambda i: (i.guild_id, i.user.id))
@@ -79,6 +160,7 @@ class Music(commands.Cog):
 
         if interaction.guild.voice_client is None:
             vc: LavalinkPlayer = await interaction.user.voice.channel.connect(self_deaf=True, cls=LavalinkPlayer)
+            vc.queue.policy = self.policies.get(interaction.guild_id)
             # wait for the bot to connect, so wait for vc.is_connected() to be True
             try:
                 async with asyncio.timeout(6):
@@ -108,21 +190,60 @@ class Music(commands.Cog):
             return await interaction.followup.send("⚠️ No song found", ephemeral=True)
         else:
             try:
-                embed = vc.queue.add(tracks)
+                embed, result, added = vc.queue.add(tracks, requester=interaction.user.id)
             except Exception as e:
                 logger.error(f"Error in queue.add: {e}")
                 return await interaction.followup.send("⚠️ An error occurred", ephemeral=True)
 
             if embed is None:
-                return await interaction.followup.send("⚠️ Could not add the song to the queue", ephemeral=True)
+                message = "⚠️ Could not add the song to the queue"
+                if result.detail:
+                    message += f": {result.detail}"
+                return await interaction.followup.send(message, ephemeral=True)
             await interaction.followup.send("✅ Added to the queue", embed=embed)
+            self.history.record(interaction.guild_id, interaction.user.id, added, "queued")
+            if not result:
+                await interaction.followup.send(f"⚠️ Some tracks were skipped: {result.detail}", ephemeral=True)
 
-        if vc.current is None or (vc.current is not None and vc.paused is True):
-            try:
-                await vc.play(vc.queue.next(), replace=True)
-            except Exception as e:
-                logger.error(f"Error in play: {e}")
-                return await interaction.followup.send("⚠️ An error occurred", ephemeral=True)
+        try:
+            await self.executor.run(interaction.guild_id, lambda: self._start(vc), key="start")
+        except Exception as e:
+            logger.error(f"Error in play: {e}")
+            return await interaction.followup.send("⚠️ An error occurred", ephemeral=True)
+
+    @app_commands.command(name="stats", description="Show the most played songs and who added more songs")
+    @app_commands.checks.cooldown(1, 10, key=lambda i: i.guild_id)
+    async def stats(self, interaction: discord.Interaction):
+        # noinspection PyTypeChecker
+        resp: discord.InteractionResponse = interaction.response
+
+        await resp.defer(thinking=True)
+
+        await self.history.flush()
+        tracks = await self.history.top_tracks(interaction.guild_id, limit=5)
+        users = await self.history.top_users(interaction.guild_id, limit=5)
+
+        if len(tracks) == 0 and len(users) == 0:
+            return await interaction.followup.send("✴️ Nothing played yet")
+
+        embed = discord.Embed(title="Stats", color=discord.Color.blurple())
+        embed.add_field(
+            name="Top songs",
+            value="\n".join(
+                f"{i}. [{discord.utils.escape_markdown(title[:60])}]({uri}) - {plays} plays"
+                for i, (title, uri, plays) in enumerate(tracks, start=1)
+            ) or "-",
+            inline=False
+        )
+        embed.add_field(
+            name="Top users",
+            value="\n".join(
+                f"{i}. <@{user_id}> - {plays} songs" for i, (user_id, plays) in enumerate(users, start=1)
+            ) or "-",
+            inline=False
+        )
+
+        await interaction.followup.send(embed=embed)
 
     @app_commands.command(name="repeat", description="Repeat the same song")
     async def repeat(self, interaction: discord.Interaction):
@@ -209,7 +330,8 @@ class Music(commands.Cog):
         else:
             try:
                 await resp.send_message(f"✅ Connecting to {channel.mention}", suppress_embeds=True)
-                await channel.connect(self_deaf=True, cls=LavalinkPlayer, timeout=10)
+                vc: LavalinkPlayer = await channel.connect(self_deaf=True, cls=LavalinkPlayer, timeout=10)
+                vc.queue.policy = self.policies.get(interaction.guild_id)
             except (discord.ClientException, asyncio.TimeoutError):
                 return await resp.send_message("❌ Could not connect to your voice channel", ephemeral=True)
 
@@ -220,8 +342,13 @@ class Music(commands.Cog):
         voice_client: LavalinkPlayer | None = interaction.guild.voice_client
 
         if voice_client:
-            await voice_client.disconnect()
-            return await resp.send_message(f"✅ Disconnected", suppress_embeds=True)
+            if not is_dj(interaction.user, voice_client.queue.policy):
+                return await resp.send_message("❌ Only DJs can disconnect the bot", ephemeral=True)
+
+            # Waits for the commands already running in the guild
+            await resp.defer(thinking=True)
+            await self.executor.run(interaction.guild_id, voice_client.disconnect)
+            return await interaction.followup.send(f"✅ Disconnected", suppress_embeds=True)
         else:
             return await resp.send_message("✴️ Already disconnected", ephemeral=True)
 
@@ -232,8 +359,19 @@ class Music(commands.Cog):
         voice_client: LavalinkPlayer | None = interaction.guild.voice_client
 
         if voice_client:
-            n = voice_client.queue.clean()
-            return await resp.send_message(f"✅ Removed {n} track(s)", suppress_embeds=True)
+            if not is_dj(interaction.user, voice_client.queue.policy):
+                return await resp.send_message("❌ Only DJs can reset the queue", ephemeral=True)
+
+            async def clean() -> int:
+                voice_client.skip_votes.clear()
+                n = voice_client.queue.clean()
+                if voice_client.current is not None:
+                    await voice_client.stop()
+                return n
+
+            await resp.defer(thinking=True)
+            n = await self.executor.run(interaction.guild_id, clean)
+            return await interaction.followup.send(f"✅ Removed {n} track(s)", suppress_embeds=True)
         else:
             return await resp.send_message("❌ Not connected to a voice channel", ephemeral=True)
 
@@ -0,0 +1,69 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import TypeVar
+
+__all__ = [
+    "GuildExecutor",
+]
+
+T = TypeVar("T")
+
+
+class GuildExecutor:
+    """
+    Run the jobs of every guild one after the other
+
+    Each guild has its own chain of tasks, so a slow job only delays the commands of the same guild
+    and no lock is shared between guilds. A job submitted with the same key of a job that is still
+    waiting to start is merged into it, and both callers get the same result.
+    """
+
+    def __init__(self):
+        self._tails: dict[int, asyncio.Task] = {}
+        self._waiting: dict[tuple[int, Hashable], asyncio.Task] = {}
+
+    def submit(self, guild_id: int, job: Callable[[], Awaitable[T]], key: Hashable | None = None) -> asyncio.Task:
+        """
+        Schedule a job after the ones already submitted for the guild
+        :param guild_id: the id of the guild
+        :param job: a coroutine function without arguments
+        :param key: jobs with the same key waiting to start are merged
+        :return: the task running the job
+        """
+        if key is not None and (guild_id, key) in self._waiting:
+            return self._waiting[(guild_id, key)]
+
+        task = asyncio.get_running_loop().create_task(
+            self._run(guild_id, self._tails.get(guild_id), job, key)
+        )
+        self._tails[guild_id] = task
+        if key is not None:
+            self._waiting[(guild_id, key)] = task
+
+        return task
+
+    async def run(self, guild_id: int, job: Callable[[], Awaitable[T]], key: Hashable | None = None) -> T:
+        """
+        Submit a job and wait for its result, cancelling the caller doesn't cancel the job
+        :param guild_id: the id of the guild
+        :param job: a coroutine function without arguments
+        :param key: jobs with the same key waiting to start are merged
+        :return: the result of the job
+        """
+        return await asyncio.shield(self.submit(guild_id, job, key))
+
+    async def _run(
+            self, guild_id: int, previous: asyncio.Task | None, job: Callable[[], Awaitable[T]], key: Hashable | None
+    ) -> T:
+        if previous is not None:
+            # The outcome of the previous job doesn't matter, only its end
+            await asyncio.wait((previous,))
+
+        if key is not None:
+            self._waiting.pop((guild_id, key), None)
+
+        try:
+            return await job()
+        finally:
+            if self._tails.get(guild_id) is asyncio.current_task():
+                del self._tails[guild_id]
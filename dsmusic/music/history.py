@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from mafic import Track
+
+__all__ = [
+    "PlayHistory",
+]
+
+
+logger = logging.getLogger('dsbot.music.history')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plays (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER,
+    identifier TEXT NOT NULL,
+    title TEXT NOT NULL,
+    uri TEXT,
+    length INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    played_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plays_guild ON plays (guild_id, played_at);
+CREATE INDEX IF NOT EXISTS plays_user ON plays (user_id, played_at);
+CREATE INDEX IF NOT EXISTS plays_time ON plays (played_at);
+
+CREATE TABLE IF NOT EXISTS track_plays (
+    guild_id INTEGER NOT NULL,
+    identifier TEXT NOT NULL,
+    title TEXT NOT NULL,
+    uri TEXT,
+    plays INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, identifier)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS track_plays_top ON track_plays (guild_id, plays DESC);
+
+CREATE TABLE IF NOT EXISTS user_plays (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    plays INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS user_plays_top ON user_plays (guild_id, plays DESC);
+"""
+
+# Events counted in the per-guild rankings
+TRACK_EVENTS = ("finished",)
+USER_EVENTS = ("queued",)
+
+# Seconds before a full buffer triggers a write again after a failure
+RETRY_DELAY = 30
+
+Row = tuple[int, int | None, str, str, str | None, int, str, int]
+
+
+class PlayHistory:
+    """
+    Append-only log of the played tracks
+
+    Records are kept in memory and written in batches from a worker thread, so the event loop never
+    waits on the disk. The rankings used by /stats are kept up to date in the same transaction.
+    """
+
+    def __init__(self, path: str = "data/history.sqlite3", max_buffer: int = 500, max_pending: int = 10_000):
+        self.path = path
+        self.max_buffer = max_buffer
+        # Plays kept in memory while the database can't be written, the oldest ones are dropped
+        self.max_pending = max_pending
+
+        self._buffer: list[Row] = []
+        self._flush_task: asyncio.Task | None = None
+        # After a failed write, a full buffer waits for the periodic flush instead of retrying on every play
+        self._retry_at: float = 0.0
+        self._flush_lock = asyncio.Lock()
+        self._db_lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def record(self, guild_id: int, user_id: int | None, track: Track, event: str):
+        """
+        Add a play to the buffer, without touching the disk
+        :param guild_id: the id of the guild
+        :param user_id: the id of the user that added the track, if known
+        :param track: the track
+        :param event: what happened to the track, "queued" or the reason why it ended
+        :return: None
+        """
+        self._buffer.append((
+            guild_id, user_id, track.identifier, track.title, track.uri, track.length // 1000, event, int(time.time())
+        ))
+
+        if (
+                len(self._buffer) >= self.max_buffer
+                and (self._flush_task is None or self._flush_task.done())
+                and time.monotonic() >= self._retry_at
+        ):
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+        elif len(self._buffer) > self.max_pending:
+            self._trim()
+
+    async def flush(self):
+        """
+        Write the buffered plays to the database
+        :return: None
+        """
+        async with self._flush_lock:
+            if len(self._buffer) == 0:
+                return
+
+            batch, self._buffer = self._buffer, []
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except sqlite3.Error as e:
+                logger.error(f"Could not write {len(batch)} plays: {e}")
+                self._buffer[:0] = batch
+                self._retry_at = time.monotonic() + RETRY_DELAY
+                self._trim()
+
+    def _trim(self):
+        dropped = len(self._buffer) - self.max_pending
+        if dropped > 0:
+            logger.error(f"Dropping the {dropped} oldest plays, the history is not being saved")
+            del self._buffer[:dropped]
+
+    def _write(self, batch: list[Row]):
+        tracks = [
+            (guild_id, identifier, title, uri)
+            for guild_id, _, identifier, title, uri, _, event, _ in batch if event in TRACK_EVENTS
+        ]
+        users = [
+            (guild_id, user_id)
+            for guild_id, user_id, _, _, _, _, event, _ in batch if event in USER_EVENTS and user_id is not None
+        ]
+
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                db.executemany(
+                    "INSERT INTO plays (guild_id, user_id, identifier, title, uri, length, event, played_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    batch
+                )
+                db.executemany(
+                    "INSERT INTO track_plays (guild_id, identifier, title, uri, plays) VALUES (?, ?, ?, ?, 1) "
+                    "ON CONFLICT (guild_id, identifier) DO UPDATE SET plays = plays + 1, title = excluded.title",
+                    tracks
+                )
+                db.executemany(
+                    "INSERT INTO user_plays (guild_id, user_id, plays) VALUES (?, ?, 1) "
+                    "ON CONFLICT (guild_id, user_id) DO UPDATE SET plays = plays + 1",
+                    users
+                )
+
+    def _query(self, sql: str, params: tuple) -> list[tuple]:
+        with self._db_lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    async def top_tracks(self, guild_id: int, limit: int = 10) -> list[tuple[str, str | None, int]]:
+        """
+        Get the most played tracks of a guild
+        :param guild_id: the id of the guild
+        :param limit: the number of tracks
+        :return: a list of (title, uri, plays)
+        """
+        return await asyncio.to_thread(
+            self._query,
+            "SELECT title, uri, plays FROM track_plays WHERE guild_id = ? ORDER BY plays DESC LIMIT ?",
+            (guild_id, limit)
+        )
+
+    async def top_users(self, guild_id: int, limit: int = 10) -> list[tuple[int, int]]:
+        """
+        Get the users that added more songs in a guild
+        :param guild_id: the id of the guild
+        :param limit: the number of users
+        :return: a list of (user id, number of /play requests)
+        """
+        return await asyncio.to_thread(
+            self._query,
+            "SELECT user_id, plays FROM user_plays WHERE guild_id = ? ORDER BY plays DESC LIMIT ?",
+            (guild_id, limit)
+        )
+
+    async def close(self):
+        await self.flush()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
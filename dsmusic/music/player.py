@@ -1,3 +1,5 @@
+from collections import deque
+from dataclasses import dataclass
 from typing import Generic
 
 import mafic
@@ -7,6 +9,18 @@ from discord._types import ClientT
 from .queue import Queue
 
 
+@dataclass(eq=False, slots=True)
+class Play:
+    """
+    A track sent to lavalink, until its end event arrives
+
+    Every play is a different object, so two copies of the same track can be told apart even if
+    lavalink reports them with the same encoded track.
+    """
+    track: mafic.Track
+    requester: int | None = None
+
+
 class LavalinkPlayer(mafic.Player, Generic[ClientT]):
     queue: Queue
 
@@ -14,11 +28,54 @@ class LavalinkPlayer(mafic.Player, Generic[ClientT]):
         super().__init__(*args, **kwargs)
 
         self.queue = Queue()
+        # Users that voted to skip the current track
+        self.skip_votes: set[int] = set()
+        # Tracks sent to lavalink whose end event didn't arrive yet, oldest first
+        self.plays: deque[Play] = deque()
+
+    async def play_track(self, track: mafic.Track, requester: int | None = None):
+        """
+        Play a track now, remembering who added it until lavalink reports its end
+        :param track: the track
+        :param requester: the id of the user that added the track
+        :return: None
+        """
+        play = Play(track, requester)
+        # Lavalink can send the end of the replaced track before answering
+        self.plays.append(play)
+        try:
+            await self.play(track, replace=True)
+        except BaseException:
+            self.plays.remove(play)
+            raise
+
+    def find_play(self, track: mafic.Track) -> Play | None:
+        """
+        Get the oldest play of a track that didn't end yet
+        :param track: the track of an event
+        :return: the play or None if the track wasn't played by the bot
+        """
+        return next((play for play in self.plays if play.track.id == track.id), None)
+
+    def end_play(self, track: mafic.Track) -> Play | None:
+        """
+        Remove the play of a track that ended, the older ones lost their end event and are removed too
+        :param track: the track of the end event
+        :return: the play that ended or None if the track wasn't played by the bot
+        """
+        play = self.find_play(track)
+        if play is not None:
+            while self.plays.popleft() is not play:
+                pass
+        return play
 
     def clean_queue(self):
         """
         Delete queue
         :return: None
         """
+        policy = self.queue.policy
         del self.queue
-        self.queue = Queue()
+        self.queue = Queue(policy=policy)
+        self.skip_votes.clear()
+        self.plays.clear()
@@ -0,0 +1,216 @@
+import json
+import logging
+import math
+import os
+from dataclasses import dataclass, fields, replace
+from enum import Enum
+
+__all__ = [
+    "Rejection",
+    "AdmissionResult",
+    "ADMITTED",
+    "QueuePolicy",
+    "QueuePolicies",
+]
+
+
+logger = logging.getLogger('dsbot.music.policy')
+
+
+class Rejection(Enum):
+    TRACK_TOO_LONG = "track_too_long"
+    QUEUE_TOO_LONG = "queue_too_long"
+    QUEUE_FULL = "queue_full"
+    USER_SHARE = "user_share"
+    DUPLICATE = "duplicate"
+
+
+@dataclass(frozen=True, slots=True)
+class AdmissionResult:
+    admitted: bool
+    reason: Rejection | None = None
+    detail: str = ""
+
+    def __bool__(self) -> bool:
+        return self.admitted
+
+
+ADMITTED = AdmissionResult(admitted=True)
+
+
+@dataclass(frozen=True, slots=True)
+class QueuePolicy:
+    """
+    Limits and moderation settings applied to the queue of a single guild
+
+    Every check only reads aggregates maintained by the queue, so the cost of
+    admitting a track does not depend on the size of the queue.
+    """
+    max_track_duration: int = 3600  # seconds, per track
+    max_queue_duration: int = 8200  # seconds, whole queue
+    max_tracks: int = 48
+    max_user_share: float = 1.0  # fraction of max_tracks a single user may hold
+    allow_duplicates: bool = True
+
+    # Moderation, without a DJ role everyone can control the player
+    dj_role: int | None = None
+    skip_vote_ratio: float = 0.5  # fraction of the listeners needed to skip without being a DJ
+
+    @property
+    def max_user_tracks(self) -> int:
+        return max(1, int(self.max_tracks * self.max_user_share))
+
+    def skip_votes_needed(self, listeners: int) -> int:
+        return max(1, math.ceil(listeners * self.skip_vote_ratio))
+
+    def evaluate(
+            self,
+            track_length: int,
+            queue_length: int,
+            queue_size: int,
+            user_tracks: int,
+            duplicates: int,
+    ) -> AdmissionResult:
+        """
+        Check if a track can be added to the queue
+        :param track_length: the length of the track in seconds
+        :param queue_length: the length of the queue in seconds
+        :param queue_size: the number of tracks in the queue
+        :param user_tracks: the number of tracks in the queue added by the same user
+        :param duplicates: the number of copies of the track already in the queue
+        :return: the outcome of the check
+        """
+        if track_length > self.max_track_duration:
+            return AdmissionResult(
+                False, Rejection.TRACK_TOO_LONG,
+                f"Tracks longer than {self.max_track_duration // 60} minutes are not allowed"
+            )
+        if queue_size >= self.max_tracks:
+            return AdmissionResult(
+                False, Rejection.QUEUE_FULL,
+                f"The queue is full ({self.max_tracks} tracks)"
+            )
+        if queue_length + track_length > self.max_queue_duration:
+            return AdmissionResult(
+                False, Rejection.QUEUE_TOO_LONG,
+                f"The queue can't be longer than {self.max_queue_duration // 60} minutes"
+            )
+        if self.max_user_share < 1.0 and user_tracks >= self.max_user_tracks:
+            return AdmissionResult(
+                False, Rejection.USER_SHARE,
+                f"You can't have more than {self.max_user_tracks} tracks in the queue"
+            )
+        if not self.allow_duplicates and duplicates > 0:
+            return AdmissionResult(
+                False, Rejection.DUPLICATE,
+                "This track is already in the queue"
+            )
+
+        return ADMITTED
+
+    @classmethod
+    def from_dict(cls, data: dict, base: "QueuePolicy | None" = None) -> "QueuePolicy":
+        """
+        Build a policy from a config entry, unknown keys and invalid values are ignored
+        :param data: the config entry
+        :param base: the policy used for the missing keys
+        :return: a QueuePolicy object
+        """
+        names = {f.name for f in fields(cls)}
+        for key in data.keys() - names:
+            logger.warning(f"Unknown queue policy option {key}")
+
+        # Out of range values are rejected like the ones of the wrong type
+        values = {}
+        for key, value in data.items():
+            if key not in names:
+                continue
+            try:
+                values[key] = _CONVERTERS[key](value)
+            except (ValueError, TypeError):
+                logger.error(f"Invalid value {value!r} for queue policy option {key}, ignoring it")
+
+        return replace(base or cls(), **values)
+
+
+def _to_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    if value in (0, 1):
+        return bool(value)
+    raise ValueError(value)
+
+
+def _to_positive_int(value) -> int:
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(value)
+    value = int(value)
+    if value <= 0:
+        raise ValueError(value)
+    return value
+
+
+def _to_optional_id(value) -> int | None:
+    # Discord ids are often quoted in json
+    return None if value is None else _to_positive_int(value)
+
+
+def _to_ratio(value) -> float:
+    """A fraction in (0, 1], 0 would disable the limit and above 1 it can never be reached"""
+    if isinstance(value, bool):
+        raise ValueError(value)
+    value = float(value)
+    if not 0 < value <= 1:
+        raise ValueError(value)
+    return value
+
+
+_CONVERTERS = {
+    "max_track_duration": _to_positive_int,
+    "max_queue_duration": _to_positive_int,
+    "max_tracks": _to_positive_int,
+    "max_user_share": _to_ratio,
+    "allow_duplicates": _to_bool,
+    "dj_role": _to_optional_id,
+    "skip_vote_ratio": _to_ratio,
+}
+
+
+class QueuePolicies:
+    """Queue policies of every guild, with a default fallback"""
+
+    def __init__(self, default: QueuePolicy | None = None, guilds: dict[int, QueuePolicy] | None = None):
+        self.default = default or QueuePolicy()
+        self.guilds = guilds or {}
+
+    def get(self, guild_id: int | None) -> QueuePolicy:
+        return self.guilds.get(guild_id, self.default)
+
+    @classmethod
+    def load(cls, path: str = "config/queue.json") -> "QueuePolicies":
+        """
+        Load the policies from a json file, missing or invalid files fall back to the defaults
+        :param path: the path of the config file
+        :return: a QueuePolicies object
+        """
+        if not os.path.isfile(path):
+            logger.info("Queue policy config not available, using defaults")
+            return cls()
+
+        try:
+            with open(path) as f:
+                data = json.load(f)
+
+            default = QueuePolicy.from_dict(data.get("default", {}))
+            guilds = {
+                int(guild_id): QueuePolicy.from_dict(entry, base=default)
+                for guild_id, entry in data.get("guilds", {}).items()
+            }
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Invalid queue policy config: {e}")
+            return cls()
+
+        logger.info(f"Loaded queue policies for {len(guilds)} guild(s)")
+        return cls(default, guilds)
@@ -1,10 +1,13 @@
 import logging
+from collections import Counter
 from random import randint
 from typing import Optional
 
 import discord
 from mafic import Track, Playlist
 
+from .policy import ADMITTED, AdmissionResult, QueuePolicy, Rejection
+
 __all__ = [
     "Queue"
 ]
@@ -68,13 +71,33 @@ def parse_seconds(seconds: int) -> str:
 
 class Queue:
     _current: Track | None = None
-    _queue: list[Track] = []
-    _queue_length: int = 0
+    _current_requester: int | None = None
 
     _loop_queue: bool = False
     _loop_current: bool = False
     _shuffle: bool = False
 
+    def __init__(self, policy: QueuePolicy | None = None):
+        self.policy = policy or QueuePolicy()
+
+        self._queue: list[Track] = []
+        self._requesters: list[int | None] = []
+
+        # Aggregates kept in sync with the queue, used to check the policy in O(1)
+        self._queue_length: int = 0
+        self._user_tracks: Counter[int] = Counter()
+        self._track_copies: Counter[str] = Counter()
+
+    @property
+    def current(self) -> Track | None:
+        """The track returned by the last call to next"""
+        return self._current
+
+    @property
+    def current_requester(self) -> int | None:
+        """The id of the user that added the current track"""
+        return self._current_requester
+
     def toggle_loop(self, status: Optional[bool] = None) -> bool:
         """
         Loop the current queue
@@ -114,54 +137,88 @@ class Queue:
 
         return self._shuffle
 
-    def _add_to_queue(self, track: Track) -> int:
+    def _add_to_queue(self, track: Track, requester: int | None = None) -> AdmissionResult:
         """
         Add a track to the queue
         :param track: the track to add
-        :return: if the track was added
+        :param requester: the id of the user that added the track
+        :return: if the track was added and why not otherwise
         """
         track_length = track.length // 1000
 
-        if track_length > 3600:  # max 1 hour
-            return -2
-        elif self._queue_length + track_length >= 8200:  # total max 132 minutes
-            return -1
-        elif len(self._queue) > 48:  # max 48 songs
-            return 0
-        else:
+        result = self.policy.evaluate(
+            track_length=track_length,
+            queue_length=self._queue_length,
+            queue_size=len(self._queue),
+            user_tracks=self._user_tracks[requester] if requester is not None else 0,
+            duplicates=self._track_copies[track.identifier],
+        )
+
+        if result:
             self._queue_length += track_length
             self._queue.append(track)
-            return 1
-
-    def add(self, data: Playlist | Track | list) -> discord.Embed | None:
+            self._requesters.append(requester)
+            if requester is not None:
+                self._user_tracks[requester] += 1
+            self._track_copies[track.identifier] += 1
+
+        return result
+
+    def _remove_from_aggregates(self, track: Track, requester: int | None):
+        self._queue_length -= track.length // 1000
+        if requester is not None:
+            self._user_tracks[requester] -= 1
+            if self._user_tracks[requester] <= 0:
+                del self._user_tracks[requester]
+        self._track_copies[track.identifier] -= 1
+        if self._track_copies[track.identifier] <= 0:
+            del self._track_copies[track.identifier]
+
+    def add(
+            self, data: Playlist | Track | list, requester: int | None = None
+    ) -> tuple[discord.Embed | None, AdmissionResult, Track | None]:
         """
         Add a playlist or a single track to the queue
 
         :param data: A playlist or a single track
-        :return: an Embed for the added object or None if the object was not added
+        :param requester: the id of the user that added the tracks
+        :return: an Embed for the added object or None if nothing was added,
+            the first rejection found (if any) and the first track added (if any)
         """
         if isinstance(data, Track):
-            if self._add_to_queue(track=data) == 1:
-                embed = track_embed(data)
-            else:
-                return None
+            result = self._add_to_queue(track=data, requester=requester)
+            if not result:
+                return None, result, None
+            embed = track_embed(data)
+            first = data
         elif isinstance(data, Playlist):
             added = 0
+            first = None
+            rejected = None
             for track in data.tracks:
-                ret = self._add_to_queue(track=track)
-                if ret == 1:
+                ret = self._add_to_queue(track=track, requester=requester)
+                if ret:
                     added += 1
-                elif ret == 0:
+                    first = first or track
+                    continue
+
+                if rejected is None:
+                    rejected = ret
+                if ret.reason in (Rejection.QUEUE_FULL, Rejection.USER_SHARE):
                     break
+
+            if added == 0:
+                return None, rejected or AdmissionResult(admitted=False, detail="The playlist is empty"), None
             embed = playlist_embed(data).add_field(name="Number of videos", value=added)
+            result = rejected or ADMITTED
         elif isinstance(data, list):
             if len(data) == 0:
-                return None
-            return self.add(data[0])
+                return None, AdmissionResult(admitted=False), None
+            return self.add(data[0], requester=requester)
         else:
-            return None
+            return None, AdmissionResult(admitted=False), None
 
-        return embed
+        return embed, result, first
 
     def next(self) -> Track | None:
         """
@@ -182,17 +239,21 @@ class Queue:
 
         try:
             track = self._queue.pop(index)
+            requester = self._requesters.pop(index)
         except IndexError:
             logger.error(f"IndexError in Queue.next, queue length: {len(self._queue)}, index: {index}")
             self._current = None
+            self._current_requester = None
             return None
 
         if self._loop_queue:
             self._queue.append(track)
+            self._requesters.append(requester)
         else:
-            self._queue_length -= track.length
+            self._remove_from_aggregates(track, requester)
 
         self._current = track
+        self._current_requester = requester
         return track
 
     def clean(self) -> int:
@@ -203,7 +264,11 @@ class Queue:
         size = len(self._queue)
         del self._queue
         self._queue = []
+        self._requesters = []
         self._queue_length = 0
+        self._user_tracks.clear()
+        self._track_copies.clear()
         self._current = None
+        self._current_requester = None
 
         return size
@@ -0,0 +1,143 @@
+import contextlib
+import importlib.abc
+import logging
+import sys
+import time
+from os import getenv
+
+__all__ = [
+    "StartupProfiler",
+    "profiler",
+]
+
+
+logger = logging.getLogger('dsbot.profiling')
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Wraps a loader to measure the execution time of its modules"""
+
+    def __init__(self, loader, profiler: "StartupProfiler"):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, item):
+        return getattr(self._loader, item)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        # The wrapper is only needed to get here, code checking the type of the loader must see the real one
+        if getattr(module, "__spec__", None) is not None and module.__spec__.loader is self:
+            module.__spec__.loader = self._loader
+        if getattr(module, "__loader__", None) is self:
+            module.__loader__ = self._loader
+
+        self._profiler.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._profiler.stack.pop()
+            if self._profiler.stack:
+                self._profiler.stack[-1] += elapsed
+            self._profiler.imports[module.__name__] = (elapsed, elapsed - children)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    def __init__(self, profiler: "StartupProfiler"):
+        self._profiler = profiler
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self._profiler)
+        return spec
+
+
+class StartupProfiler:
+    """
+    Measure import and initialization times until the bot is ready
+
+    It is enabled with the environment variable PROFILE_STARTUP=1, otherwise every method is a no-op.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.start = time.perf_counter()
+
+        # module name -> (cumulative time, self time)
+        self.imports: dict[str, tuple[float, float]] = {}
+        self.phases: dict[str, float] = {}
+        self.stack: list[float] = []
+
+        self._finder: _ImportTimer | None = None
+
+    def install(self):
+        """
+        Start measuring the imports
+        :return: None
+        """
+        if not self.enabled or self._finder is not None:
+            return
+
+        self._finder = _ImportTimer(self)
+        sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+
+    @contextlib.contextmanager
+    def measure(self, phase: str):
+        """
+        Measure the time spent in a phase of the initialization
+        :param phase: the name of the phase
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = time.perf_counter() - start
+
+    def report(self, top: int = 20):
+        """
+        Log the slowest imports and phases, then stop measuring
+        :param top: the number of imports to show
+        :return: None
+        """
+        if not self.enabled:
+            return
+
+        self.uninstall()
+
+        logger.info(f"Ready after {(time.perf_counter() - self.start) * 1000:.1f}ms")
+
+        for phase, elapsed in self.phases.items():
+            logger.info(f"{elapsed * 1000:9.1f}ms  {phase}")
+
+        slowest = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        logger.info(f"{len(self.imports)} modules imported, slowest by self time (cumulative / self):")
+        for name, (cumulative, own) in slowest:
+            logger.info(f"{cumulative * 1000:9.1f}ms {own * 1000:9.1f}ms  {name}")
+
+        self.enabled = False
+
+
+profiler = StartupProfiler(enabled=int(getenv("PROFILE_STARTUP", "0")) == 1)